@@ -0,0 +1,27 @@
+"""
+Benchmarks of the simulation hot paths.
+
+Micro-benchmarks time single calls of the force and dynamics functions;
+macro-benchmarks time whole simulations (experiment 1 traverse, EDL descent,
+parachute sweep, one optimizer iteration). Each benchmark records its wall
+time, the number of dynamics (RHS) evaluations and its peak traced memory.
+Results are saved as JSON, and a later run can be compared against them to
+flag regressions.
+
+Usage (from the repository root):
+
+    python -m benchmarks run -o baseline.json
+    python -m benchmarks compare baseline.json --threshold 0.2
+
+benchmarks.profiling runs any of the project's scripts, or a function such
+as parachute_sweep:sweep_parachute, under cProfile, a stack sampler or
+tracemalloc, without editing it:
+
+    python -m benchmarks profile study_parachute_size.py
+    python -m benchmarks profile --mode sample -o sweep.collapsed \
+        parachute_sweep:sweep_parachute "[14, 16, 18]" processes=1
+"""
+
+from benchmarks.harness import run_benchmarks, save_results, load_results, compare_results
+from benchmarks.cases import BENCHMARKS
+from benchmarks.profiling import profile_target
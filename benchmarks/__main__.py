@@ -0,0 +1,74 @@
+import argparse
+import sys
+from benchmarks.harness import (run_benchmarks, save_results, load_results, compare_results,
+                                format_comparison)
+from benchmarks.profiling import profile_target, PROFILE_MODES
+
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmarks of the simulation hot paths")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("-o", "--output", help="write the results to this JSON file")
+
+    compare = commands.add_parser("compare", help="run the benchmarks and compare them to a baseline")
+    compare.add_argument("baseline", help="JSON file written by 'run -o'")
+    compare.add_argument("--threshold", type=float, default=0.2,
+                         help="relative increase counted as a regression (default: 0.2)")
+    compare.add_argument("-o", "--output", help="also write the new results to this JSON file")
+
+    for command in (run, compare):
+        command.add_argument("-k", "--pattern", default="*",
+                             help="only run benchmarks matching this pattern, e.g. 'micro.*'")
+        command.add_argument("-r", "--repeat", type=int, help="timing samples per benchmark")
+        command.add_argument("--quick", action="store_true", help="fewer calls and samples")
+
+    profile = commands.add_parser("profile", help="run a script or function under a profiler")
+    profile.add_argument("--mode", choices=PROFILE_MODES, default="cprofile",
+                         help="cprofile, sample (collapsed stacks) or memory (tracemalloc)")
+    profile.add_argument("-o", "--output",
+                         help="write the raw profile (pstats, collapsed stacks or snapshot) to this file")
+    profile.add_argument("--top", type=int, default=25, help="number of functions listed")
+    profile.add_argument("--interval", type=float, default=0.005,
+                         help="sampling interval [s] of the sample and memory modes")
+    profile.add_argument("target", help="script path, or module:function")
+    profile.add_argument("args", nargs=argparse.REMAINDER,
+                         help="script arguments, or function arguments as python literals (name=value for keywords)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "profile":
+        profile_target(args.target, args.args, args.mode, args.output, args.top, args.interval)
+        return 0
+
+    if args.command == "compare":
+        baseline = load_results(args.baseline)
+
+    results = run_benchmarks(args.pattern, args.repeat, args.quick)
+
+    if args.output:
+        save_results(results, args.output)
+
+    if args.command == "run":
+        return 0
+
+    comparison = compare_results(baseline, results, args.threshold)
+    print()
+    for entry in comparison:
+        print(format_comparison(entry))
+
+    regressions = [entry["name"] for entry in comparison if entry["regressions"]]
+    if regressions:
+        print("\n{} regression(s) above {:.0%}: {}".format(len(regressions), args.threshold,
+                                                           ", ".join(regressions)))
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
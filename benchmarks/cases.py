@@ -0,0 +1,249 @@
+import copy
+import numpy as np
+
+
+
+# Benchmark registry
+#
+# BENCHMARKS maps a name to a dict with
+#   'kind'   : 'micro' (one function call) or 'macro' (a whole simulation)
+#   'setup'  : function returning the zero-argument callable that is timed;
+#              everything that is not part of the measured work (defining
+#              the rover, planet, edl_system, ...) happens here
+#   'count'  : function returning the (module, function name) pairs whose
+#              calls are counted (the dynamics, i.e. RHS evaluations, for
+#              the simulations)
+#   'number' : calls per timing sample
+#   'repeat' : timing samples
+#
+# The project modules are imported inside the setup functions, so a
+# benchmark whose modules are missing is skipped instead of breaking the
+# whole suite.
+
+
+def _rover_setup():
+    # rover, planet and Crr of subfunctions plus the experiment 1 traverse
+    # of rover_experiment1.py
+
+    from subfunctions import rover, planet, Crr
+    from define_experiment import experiment1
+
+    experiment, end_event = experiment1()
+    end_event['max_distance'] = 1000
+    end_event['max_time'] = 10000
+    end_event['min_velocity'] = 0.01
+
+    return copy.deepcopy(rover), planet, Crr, experiment, end_event
+
+
+def _edl_setup(drag_model='original'):
+    # baseline EDL descent of study_parachute_size.py: parachute open at
+    # 11 km, -590 m/s
+
+    from define_edl_system import define_edl_system_1
+    from define_planet import define_planet
+    from define_mission_events import define_mission_events
+    from redefine_edl_system import redefine_edl_system
+
+    edl_system = redefine_edl_system(define_edl_system_1())
+    edl_system['drag_model'] = drag_model
+
+    return edl_system, define_planet(), define_mission_events()
+
+
+def _rover_dynamics_count():
+
+    import subfunctions
+    return [(subfunctions, 'rover_model_dynamics')]
+
+
+def _edl_dynamics_count():
+
+    import subfunctions_EDL
+    return [(subfunctions_EDL, 'edl_dynamics')]
+
+
+def _design_simulations_count():
+    # the phase 4 simulators live in subfunctions_Phase4; count the
+    # simulations the design evaluation asks for
+
+    import design_evaluation
+    return [(design_evaluation, 'simulate_edl'), (design_evaluation, 'simulate_rover')]
+
+
+def _no_count():
+
+    return []
+
+
+def setup_F_net_scalar():
+
+    from subfunctions import F_net
+    rover, planet, Crr, _, _ = _rover_setup()
+
+    return lambda: F_net(1.5, 5.0, rover, planet, Crr)
+
+
+def setup_F_net_array():
+
+    from subfunctions import F_net
+    rover, planet, Crr, _, _ = _rover_setup()
+    omega = np.linspace(0.0, 3.0, 1000)
+    terrain_angle = np.linspace(-20.0, 20.0, 1000)
+
+    return lambda: F_net(omega, terrain_angle, rover, planet, Crr)
+
+
+def setup_F_net_kernel_scalar():
+    # what rover_model_dynamics calls on every step, against F_net above
+
+    from subfunctions import _force_model, _F_net_scalar
+    rover, planet, Crr, _, _ = _rover_setup()
+    model = _force_model(rover, planet)
+
+    return lambda: _F_net_scalar(1.5, 5.0, Crr, model)
+
+
+def setup_F_net_kernel_array():
+
+    from subfunctions import _force_model, _F_net_kernel
+    rover, planet, Crr, _, _ = _rover_setup()
+    model = _force_model(rover, planet)
+    omega = np.linspace(0.0, 3.0, 1000)
+    terrain_angle = np.linspace(-20.0, 20.0, 1000)
+
+    return lambda: _F_net_kernel(omega, terrain_angle, Crr, model)
+
+
+def setup_rover_dynamics():
+
+    from subfunctions import rover_dynamics
+    rover, planet, _, experiment, _ = _rover_setup()
+    y = np.array([0.3, 250.0])
+
+    return lambda: rover_dynamics(20.0, y, rover, planet, experiment)
+
+
+def setup_rover_model_dynamics():
+
+    from subfunctions import compile_rover_model, rover_model_dynamics
+    rover, planet, _, experiment, _ = _rover_setup()
+    model = compile_rover_model(rover, planet, experiment)
+    y = np.array([0.3, 250.0])
+
+    return lambda: rover_model_dynamics(20.0, y, model)
+
+
+def setup_motor_telemetry():
+
+    from subfunctions import motor_telemetry
+    rover, _, _, _, _ = _rover_setup()
+    t = np.linspace(0.0, 5000.0, 50000)
+    v = 0.3 + 0.05*np.sin(t/100.0)
+
+    return lambda: motor_telemetry(t, v, rover)
+
+
+def _setup_edl_dynamics(drag_model):
+
+    from subfunctions_EDL import edl_dynamics
+    edl_system, planet, _ = _edl_setup(drag_model)
+    y = np.array([-90.0, 7000.0, 230.0, 0.0, 0.0, 0.0, 0.0])
+
+    return lambda: edl_dynamics(50.0, y, edl_system, planet)
+
+
+def setup_edl_dynamics_original():
+
+    return _setup_edl_dynamics('original')
+
+
+def setup_edl_dynamics_mach():
+
+    return _setup_edl_dynamics('mach_corrected')
+
+
+def setup_simulate_rover():
+
+    from subfunctions import simulate_rover
+    rover, planet, _, experiment, end_event = _rover_setup()
+
+    return lambda: simulate_rover(rover, planet, experiment, end_event)
+
+
+def setup_simulate_edl():
+
+    from subfunctions_EDL import simulate_edl
+    edl_system, planet, mission_events = _edl_setup()
+
+    return lambda: simulate_edl(edl_system, planet, mission_events, 2000, False)
+
+
+def setup_sweep_parachute():
+
+    from parachute_sweep import sweep_parachute
+    diameters = np.linspace(14.0, 19.0, 6)
+
+    return lambda: sweep_parachute(diameters, processes=1)
+
+
+def setup_design_iteration():
+    # one optimizer iteration of the phase 4 script: the design at x0 and
+    # its finite-difference neighbours, nothing cached from earlier calls
+
+    from subfunctions_Phase4 import (define_planet, define_edl_system, define_mission_events,
+                                     define_chassis, define_motor, define_batt_pack)
+    from define_experiment import experiment1
+    from design_evaluation import define_design_problem, new_design_cache, fd_derivatives
+
+    planet = define_planet()
+    edl_system = define_edl_system()
+    mission_events = define_mission_events()
+    edl_system = define_chassis(edl_system, 'carbon')
+    edl_system = define_motor(edl_system, 'base')
+    edl_system = define_batt_pack(edl_system, 'PbAcid-1', 10)
+    edl_system['altitude'] = 11000
+    edl_system['velocity'] = -587
+    edl_system['parachute']['deployed'] = True
+    edl_system['parachute']['ejected'] = False
+    edl_system['rover']['on_ground'] = False
+
+    experiment, end_event = experiment1()
+    max_batt_energy_per_meter = edl_system['rover']['power_subsys']['battery']['capacity']/1000
+
+    problem = define_design_problem(edl_system, planet, mission_events, 5000, experiment, end_event,
+                                    40000, 1, 7.2e6, max_batt_energy_per_meter)
+    x0 = np.array([14.9, 0.70, 280.0, 0.05, 230.0])
+    upper = np.array([15.2, 0.70, 290, 0.055, 230])
+
+    return lambda: fd_derivatives(x0, problem, new_design_cache(), upper=upper)
+
+
+BENCHMARKS = {
+    'micro.F_net_scalar': {'kind': 'micro', 'setup': setup_F_net_scalar,
+                           'count': _no_count, 'number': 2000, 'repeat': 5},
+    'micro.F_net_array': {'kind': 'micro', 'setup': setup_F_net_array,
+                          'count': _no_count, 'number': 200, 'repeat': 5},
+    'micro.F_net_kernel_scalar': {'kind': 'micro', 'setup': setup_F_net_kernel_scalar,
+                                  'count': _no_count, 'number': 20000, 'repeat': 5},
+    'micro.F_net_kernel_array': {'kind': 'micro', 'setup': setup_F_net_kernel_array,
+                                 'count': _no_count, 'number': 200, 'repeat': 5},
+    'micro.rover_dynamics': {'kind': 'micro', 'setup': setup_rover_dynamics,
+                             'count': _no_count, 'number': 1000, 'repeat': 5},
+    'micro.rover_model_dynamics': {'kind': 'micro', 'setup': setup_rover_model_dynamics,
+                                   'count': _no_count, 'number': 5000, 'repeat': 5},
+    'micro.motor_telemetry': {'kind': 'micro', 'setup': setup_motor_telemetry,
+                              'count': _no_count, 'number': 20, 'repeat': 5},
+    'micro.edl_dynamics_original': {'kind': 'micro', 'setup': setup_edl_dynamics_original,
+                                    'count': _no_count, 'number': 2000, 'repeat': 5},
+    'micro.edl_dynamics_mach': {'kind': 'micro', 'setup': setup_edl_dynamics_mach,
+                                'count': _no_count, 'number': 2000, 'repeat': 5},
+    'macro.simulate_rover': {'kind': 'macro', 'setup': setup_simulate_rover,
+                             'count': _rover_dynamics_count, 'number': 1, 'repeat': 3},
+    'macro.simulate_edl': {'kind': 'macro', 'setup': setup_simulate_edl,
+                           'count': _edl_dynamics_count, 'number': 1, 'repeat': 3},
+    'macro.sweep_parachute': {'kind': 'macro', 'setup': setup_sweep_parachute,
+                              'count': _edl_dynamics_count, 'number': 1, 'repeat': 3},
+    'macro.design_iteration': {'kind': 'macro', 'setup': setup_design_iteration,
+                               'count': _design_simulations_count, 'number': 1, 'repeat': 3},
+}
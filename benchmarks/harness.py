@@ -0,0 +1,268 @@
+import datetime
+import fnmatch
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+import scipy
+
+
+
+# Benchmark harness
+#
+# A benchmark is a row of BENCHMARKS (see cases.py): a setup function that
+# returns the zero-argument callable to time, the number of calls per timing
+# sample and the functions whose calls are counted. Timing, call counting
+# and memory tracing are done in separate runs, so the counting wrappers and
+# tracemalloc do not slow down the timed runs.
+
+
+@contextmanager
+def count_calls(targets):
+    """
+    Counts the calls of module-level functions while the context is open.
+
+    Input:
+    targets : sequence
+        (module, function name) pairs. The simulators look their dynamics
+        up in the module at call time, so replacing the module attribute
+        catches every call.
+
+    Output:
+    counts : dict
+        '<module>.<name>' -> number of calls, filled in as the calls happen
+    """
+
+    counts = {}
+    originals = []
+
+    for module, name in targets:
+        key = module.__name__ + "." + name
+        counts[key] = 0
+        original = getattr(module, name)
+        originals.append((module, name, original))
+
+        def counted(*args, _original=original, _key=key, **kwargs):
+            counts[_key] += 1
+            return _original(*args, **kwargs)
+
+        setattr(module, name, counted)
+
+    try:
+        yield counts
+    finally:
+        for module, name, original in originals:
+            setattr(module, name, original)
+
+
+def peak_memory(run):
+    """
+    Peak memory (bytes) traced by tracemalloc during one call of run.
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return peak
+
+
+def time_calls(run, number, repeat):
+    """
+    Wall times (s) per call of run: repeat samples of number calls each.
+    """
+
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        times.append((time.perf_counter() - start) / number)
+
+    return np.array(times)
+
+
+def run_benchmark(benchmark, repeat=None, quick=False):
+    """
+    Runs one benchmark (a row of BENCHMARKS).
+
+    Output:
+    result : dict
+        kind, number (calls per sample), repeat, wall_time (best time per
+        call, s), wall_time_median (s), rhs_calls (calls per run of each
+        counted function) and peak_memory (bytes)
+    """
+
+    run = benchmark["setup"]()
+
+    number = benchmark["number"]
+    if repeat is None:
+        repeat = benchmark["repeat"]
+    if quick:
+        number = max(1, number // 10)
+        repeat = min(repeat, 2)
+
+    # warm up (module-level caches, first-call imports)
+    run()
+
+    times = time_calls(run, number, repeat)
+
+    with count_calls(benchmark["count"]()) as counts:
+        run()
+
+    result = {"kind": benchmark["kind"],
+              "number": number,
+              "repeat": repeat,
+              "wall_time": float(times.min()),
+              "wall_time_median": float(np.median(times)),
+              "rhs_calls": dict(counts),
+              "peak_memory": int(peak_memory(run))
+              }
+
+    return result
+
+
+def run_benchmarks(pattern="*", repeat=None, quick=False, verbose=True):
+    """
+    Runs the benchmarks whose names match pattern (fnmatch syntax).
+
+    Input:
+    pattern : str
+        Benchmark name pattern, e.g. 'micro.*' or '*edl*'
+    repeat : int
+        Timing samples per benchmark (default: the benchmark's own)
+    quick : bool
+        Fewer calls and samples, for a smoke test
+    verbose : bool
+        Print each result as it is measured
+
+    Output:
+    results : dict
+        meta (interpreter and library versions, date) and benchmarks (name
+        -> result of run_benchmark, or {'skipped': reason} when a module the
+        benchmark needs cannot be imported)
+    """
+
+    from benchmarks.cases import BENCHMARKS
+
+    results = {"meta": {"python": sys.version.split()[0],
+                        "numpy": np.__version__,
+                        "scipy": scipy.__version__,
+                        "platform": platform.platform(),
+                        "date": datetime.datetime.now().isoformat(timespec="seconds")
+                        },
+               "benchmarks": {}
+               }
+
+    for name, benchmark in BENCHMARKS.items():
+        if not fnmatch.fnmatch(name, pattern):
+            continue
+        try:
+            result = run_benchmark(benchmark, repeat, quick)
+        except ImportError as error:
+            result = {"skipped": str(error)}
+        results["benchmarks"][name] = result
+        if verbose:
+            print(format_result(name, result))
+
+    return results
+
+
+def format_result(name, result):
+    """
+    One line summary of a benchmark result.
+    """
+
+    if "skipped" in result:
+        return "{:<32} skipped ({})".format(name, result["skipped"])
+
+    rhs = sum(result["rhs_calls"].values())
+
+    return "{:<32} {:>12.3e} s {:>10d} calls {:>10.1f} KiB".format(
+        name, result["wall_time"], rhs, result["peak_memory"] / 1024)
+
+
+def save_results(results, path):
+    """
+    Writes benchmark results to a JSON file.
+    """
+
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load_results(path):
+    """
+    Reads benchmark results written by save_results.
+    """
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(baseline, current, threshold=0.2):
+    """
+    Compares two sets of benchmark results.
+
+    Input:
+    baseline, current : dict
+        Results of run_benchmarks (or load_results)
+    threshold : float
+        Relative increase of wall time, RHS calls or peak memory above which
+        a benchmark counts as a regression (0.2 = 20 %)
+
+    Output:
+    comparison : list
+        One dict per benchmark in both results: name, metric ratios
+        (current / baseline) and regressions (names of the metrics that
+        grew by more than threshold)
+    """
+
+    comparison = []
+
+    for name, new in current["benchmarks"].items():
+        old = baseline["benchmarks"].get(name)
+        if old is None or "skipped" in old or "skipped" in new:
+            continue
+
+        ratios = {"wall_time": _ratio(new["wall_time"], old["wall_time"]),
+                  "rhs_calls": _ratio(sum(new["rhs_calls"].values()), sum(old["rhs_calls"].values())),
+                  "peak_memory": _ratio(new["peak_memory"], old["peak_memory"])
+                  }
+        regressions = [metric for metric, ratio in ratios.items() if ratio > 1 + threshold]
+
+        comparison.append({"name": name, "ratios": ratios, "regressions": regressions})
+
+    return comparison
+
+
+def _ratio(new, old):
+    # current / baseline; a metric that was zero is only a change if it grew
+
+    if old == 0:
+        return 1.0 if new == 0 else np.inf
+
+    return new / old
+
+
+def format_comparison(entry):
+    """
+    One line summary of a compare_results entry.
+    """
+
+    ratios = entry["ratios"]
+    flag = "REGRESSION (" + ", ".join(entry["regressions"]) + ")" if entry["regressions"] else "ok"
+
+    return "{:<32} time x{:<7.3f} calls x{:<7.3f} memory x{:<7.3f} {}".format(
+        entry["name"], ratios["wall_time"], ratios["rhs_calls"], ratios["peak_memory"], flag)
@@ -0,0 +1,365 @@
+import ast
+import cProfile
+import importlib
+import os
+import pstats
+import runpy
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+
+
+# Profiling runner
+#
+# Runs one of the project's scripts (through runpy, as if it was started
+# with python) or one of its functions under a profiler, without editing
+# anything:
+#   'cprofile' : deterministic profile (cProfile); optionally saved as a
+#                pstats file
+#   'sample'   : the stack is sampled every interval seconds of CPU time;
+#                optionally saved as collapsed stacks ('a;b;c count' lines,
+#                the input of flamegraph.pl and speedscope)
+#   'memory'   : tracemalloc; the peak traced memory and the allocation
+#                sites at the largest traced size seen; optionally saved as
+#                a tracemalloc snapshot
+# Each report splits the time (or memory) into the project's functions,
+# solve_ivp internals (scipy.integrate._ivp), numpy, the rest of scipy and
+# everything else. Figures are drawn with the Agg backend, so plt.show()
+# does not block.
+#
+# Only the process the runner is started in is profiled: run sweeps with
+# processes=1 to see the simulations themselves.
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILE_MODES = ("cprofile", "sample", "memory")
+
+_NAMES = {}
+
+
+def code_location(filename):
+    """
+    Group and dotted module name of a source file.
+
+    Output:
+    group : str
+        'project', 'solve_ivp' (scipy.integrate._ivp), 'numpy', 'scipy' or
+        'other'
+    module : str
+        Dotted module name (the file name for files outside sys.path)
+    """
+
+    location = _NAMES.get(filename)
+    if location is not None:
+        return location
+
+    path = os.path.abspath(filename)
+    if os.path.dirname(path) == PROJECT_DIR:
+        module = os.path.relpath(os.path.splitext(path)[0], PROJECT_DIR).replace(os.sep, ".")
+        group = "project"
+    else:
+        module = filename
+        roots = [root for root in sys.path if root and path.startswith(os.path.abspath(root) + os.sep)]
+        if roots:
+            root = max(roots, key=len)
+            module = os.path.relpath(os.path.splitext(path)[0], os.path.abspath(root)).replace(os.sep, ".")
+        if module.startswith("scipy.integrate._ivp"):
+            group = "solve_ivp"
+        elif module.split(".")[0] in ("numpy", "scipy"):
+            group = module.split(".")[0]
+        else:
+            group = "other"
+
+    _NAMES[filename] = (group, module)
+
+    return group, module
+
+
+def _target_callable(target, args):
+    # zero-argument callable that runs target: a script path (args become
+    # sys.argv[1:]) or 'module:function' (args are python literals,
+    # 'name=value' for keyword arguments)
+
+    if os.path.isfile(target):
+        path = os.path.abspath(target)
+
+        def run():
+            argv, path0 = sys.argv, sys.path[0]
+            sys.argv = [path] + list(args)
+            sys.path[0] = os.path.dirname(path)
+            try:
+                runpy.run_path(path, run_name="__main__")
+            finally:
+                sys.argv, sys.path[0] = argv, path0
+
+        return run
+
+    if ":" not in target:
+        raise Exception("target must be a script or 'module:function': " + target)
+
+    module_name, function_name = target.split(":", 1)
+    if PROJECT_DIR not in sys.path:
+        sys.path.insert(0, PROJECT_DIR)
+    function = getattr(importlib.import_module(module_name), function_name)
+
+    positional = []
+    keywords = {}
+    for arg in args:
+        name, sep, value = arg.partition("=")
+        if sep and name.isidentifier():
+            keywords[name] = ast.literal_eval(value)
+        else:
+            positional.append(ast.literal_eval(arg))
+
+    return lambda: function(*positional, **keywords)
+
+
+def profile_target(target, args=(), mode="cprofile", output=None, top=25, interval=0.005):
+    """
+    Runs a script or function under a profiler and prints a report.
+
+    Input:
+    target : str
+        Path of a script, or 'module:function'
+    args : sequence
+        Command line arguments of the script, or the arguments of the
+        function as python literals ('name=value' for keyword arguments)
+    mode : str
+        One of PROFILE_MODES
+    output : str
+        File for the raw profile (pstats file, collapsed stacks or
+        tracemalloc snapshot, depending on mode); optional
+    top : int
+        Number of functions (or allocation sites) listed
+    interval : float
+        Sampling interval [s] of the 'sample' and 'memory' modes
+
+    Output:
+    report : str
+        The report that was printed
+    """
+
+    if mode not in PROFILE_MODES:
+        raise Exception("mode must be one of " + ", ".join(PROFILE_MODES))
+
+    # must be set before the target imports matplotlib
+    os.environ["MPLBACKEND"] = "Agg"
+    if "matplotlib" in sys.modules:
+        sys.modules["matplotlib"].use("Agg")
+
+    run = _target_callable(target, args)
+
+    if mode == "cprofile":
+        report = profile_cprofile(run, output, top)
+    elif mode == "sample":
+        report = profile_sample(run, output, top, interval)
+    else:
+        report = profile_memory(run, output, top, interval)
+
+    print(report)
+
+    return report
+
+
+def profile_cprofile(run, output=None, top=25):
+    """
+    Deterministic profile of run(); see profile_target.
+    """
+
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        run()
+    finally:
+        profiler.disable()
+    wall_time = time.perf_counter() - start
+
+    if output:
+        profiler.dump_stats(output)
+
+    stats = pstats.Stats(profiler).stats
+
+    # self time per group, and the project's own functions
+    groups = Counter()
+    functions = []
+    for (filename, line, name), (_, ncalls, tottime, cumtime, _) in stats.items():
+        if filename == "~":
+            # built-in functions and methods, numpy's ufuncs among them
+            group, module = ("numpy" if "numpy" in name else "other"), "builtins"
+        else:
+            group, module = code_location(filename)
+        groups[group] += tottime
+        if group == "project" or group == "solve_ivp":
+            functions.append((tottime, cumtime, ncalls, module + "." + name, group))
+
+    functions.sort(reverse=True)
+
+    lines = ["cProfile: {:.3f} s wall time (with profiling overhead)".format(wall_time), "",
+             "self time by group"]
+    lines += _group_lines(groups, "{:10.3f} s")
+    lines += ["", "{:<64} {:>10} {:>10} {:>10}".format("function", "calls", "self [s]", "cum [s]")]
+    for tottime, cumtime, ncalls, name, _ in functions[:top]:
+        lines.append("{:<64} {:>10d} {:>10.3f} {:>10.3f}".format(name, ncalls, tottime, cumtime))
+
+    return "\n".join(lines)
+
+
+def _frame_stack(frame):
+    # (group, 'module.function') of frame and its callers, outermost first,
+    # without the frames of this runner (and runpy) below the target
+
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        group, module = code_location(code.co_filename)
+        if module.startswith("benchmarks.") or module == "runpy":
+            break
+        stack.append((group, module + "." + getattr(code, "co_qualname", code.co_name)))
+        frame = frame.f_back
+    stack.reverse()
+
+    return tuple(stack)
+
+
+def profile_sample(run, output=None, top=25, interval=0.005):
+    """
+    Sampling profile of run(); see profile_target.
+    """
+
+    stacks = Counter()
+
+    def sample(frame):
+        stack = _frame_stack(frame)
+        if stack:
+            stacks[stack] += 1
+
+    start = time.perf_counter()
+    if hasattr(signal, "setitimer"):
+        # SIGPROF every interval seconds of CPU time; the handler runs in the
+        # main thread at the next bytecode boundary, with its frame
+        previous = signal.signal(signal.SIGPROF, lambda signum, frame: sample(frame))
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+        try:
+            run()
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, previous)
+    else:
+        # no interval timers (Windows): sample from a thread. The thread
+        # only gets the GIL when the main thread lets go of it, so the
+        # samples favour the calls that release the GIL (BLAS, I/O)
+        main_thread = threading.get_ident()
+        done = threading.Event()
+
+        def sampler():
+            while not done.wait(interval):
+                sample(sys._current_frames().get(main_thread))
+
+        thread = threading.Thread(target=sampler, daemon=True)
+        thread.start()
+        try:
+            run()
+        finally:
+            done.set()
+            thread.join()
+    wall_time = time.perf_counter() - start
+
+    if output:
+        with open(output, "w") as f:
+            for stack, count in stacks.items():
+                f.write("{} {}\n".format(";".join(name for _, name in stack), count))
+
+    # self samples per group (innermost frame) and inclusive samples per
+    # project function (anywhere on the stack, counted once per sample)
+    groups = Counter()
+    inclusive = Counter()
+    own = Counter()
+    for stack, count in stacks.items():
+        group, name = stack[-1]
+        groups[group] += count
+        own[name] += count
+        for group, name in set(stack):
+            if group in ("project", "solve_ivp"):
+                inclusive[name] += count
+
+    total = max(sum(stacks.values()), 1)
+    lines = ["sampling: {:.3f} s wall time, {} samples every {:.1f} ms of CPU time".format(
+        wall_time, sum(stacks.values()), 1e3*interval), "", "self samples by group"]
+    lines += _group_lines(groups, "{:10d}")
+    lines += ["", "{:<64} {:>10} {:>10}".format("function", "self", "total")]
+    for name, count in inclusive.most_common(top):
+        lines.append("{:<64} {:>9.1f}% {:>9.1f}%".format(name, 100*own[name]/total, 100*count/total))
+
+    return "\n".join(lines)
+
+
+def profile_memory(run, output=None, top=25, interval=0.005):
+    """
+    Memory profile of run(); see profile_target.
+    """
+
+    tracemalloc.start(25)
+    snapshot = None
+    snapshot_size = 0
+    done = threading.Event()
+
+    def watcher():
+        # snapshot at (close to) the largest traced size
+        nonlocal snapshot, snapshot_size
+        while not done.wait(interval):
+            size = tracemalloc.get_traced_memory()[0]
+            if size > 1.1*snapshot_size:
+                snapshot, snapshot_size = tracemalloc.take_snapshot(), size
+
+    thread = threading.Thread(target=watcher, daemon=True)
+    thread.start()
+    try:
+        run()
+    finally:
+        done.set()
+        thread.join()
+        current, peak = tracemalloc.get_traced_memory()
+        if snapshot is None or current > snapshot_size:
+            snapshot, snapshot_size = tracemalloc.take_snapshot(), current
+        tracemalloc.stop()
+
+    if output:
+        snapshot.dump(output)
+
+    # memory held at the snapshot, by the innermost project (or solve_ivp)
+    # frame that allocated it
+    groups = Counter()
+    sites = Counter()
+    for trace in snapshot.traces:
+        group, site = "other", None
+        for frame in reversed(trace.traceback):
+            frame_group, module = code_location(frame.filename)
+            if frame_group in ("project", "solve_ivp"):
+                group, site = frame_group, "{}:{}".format(module, frame.lineno)
+                break
+            if group == "other":
+                group = frame_group
+        groups[group] += trace.size
+        if site is not None:
+            sites[site] += trace.size
+
+    lines = ["tracemalloc: peak {:.1f} KiB, snapshot at {:.1f} KiB".format(peak/1024, snapshot_size/1024),
+             "", "snapshot memory by group [KiB]"]
+    lines += _group_lines({group: size/1024 for group, size in groups.items()}, "{:10.1f}")
+    lines += ["", "{:<64} {:>10}".format("allocated in", "KiB")]
+    for site, size in sites.most_common(top):
+        lines.append("{:<64} {:>10.1f}".format(site, size/1024))
+
+    return "\n".join(lines)
+
+
+def _group_lines(groups, fmt):
+    # one line per group, largest first
+
+    return ["  {:<12} ".format(group) + fmt.format(value)
+            for group, value in sorted(groups.items(), key=lambda item: -item[1])]
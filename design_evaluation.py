@@ -0,0 +1,745 @@
+import copy
+import hashlib
+import multiprocessing
+import os
+import types
+from collections import OrderedDict
+import numpy as np
+from subfunctions_Phase4 import redefine_edl_system, simulate_edl, simulate_rover, get_cost_edl
+from subfunctions_EDL import tabulated_planet, get_mass_rover
+
+
+
+# Design evaluation for the phase 4 optimizers
+#
+# Design vector elements (in order):
+#   - parachute diameter [m]
+#   - wheel radius [m]
+#   - chassis mass [kg]
+#   - speed reducer gear diameter (d2) [m]
+#   - rocket fuel mass [kg]
+#
+# obj_fun_time and constraints_edl_system each run the coupled EDL + rover
+# simulation, so an optimizer that asks for the objective and the constraints
+# at the same x (plus a callback that reports the objective) simulates every
+# design two or three times. evaluate_design runs the simulation once per
+# design and keeps the results in a bounded LRU cache, from which the
+# objective, the constraint vector and the reporting fields are all served.
+
+
+def define_design_problem(edl_system, planet, mission_events, tmax, experiment, end_event,
+                          min_strength, max_rover_velocity, max_cost, max_batt_energy_per_meter):
+    """
+    Packs everything a design evaluation needs into one dictionary. The
+    baseline edl_system is copied and reset to the start of the descent
+    (redefine_edl_system) once, so later changes to the caller's
+    edl_system do not leak into the evaluations (and evaluations do not
+    modify it).
+
+    Input:
+    edl_system, planet, mission_events, tmax, experiment, end_event :
+        Same as for obj_fun_time / constraints_edl_system
+    min_strength, max_rover_velocity, max_cost, max_batt_energy_per_meter : float
+        Constraint limits, same as for constraints_edl_system
+
+    Output:
+    problem : dict
+    """
+
+    if not isinstance(edl_system, dict):
+        raise Exception("edl_system must be a dictionary")
+
+    problem = {"edl_system": redefine_edl_system(copy.deepcopy(edl_system)),
+               "planet": planet,
+               "mission_events": mission_events,
+               "tmax": tmax,
+               "experiment": experiment,
+               "end_event": end_event,
+               "min_strength": min_strength,
+               "max_rover_velocity": max_rover_velocity,
+               "max_cost": max_cost,
+               "max_batt_energy_per_meter": max_batt_energy_per_meter
+               }
+
+    return problem
+
+
+def apply_design(x, edl_system):
+    """
+    Writes the design vector x into edl_system (in place) and returns it.
+    """
+
+    edl_system['parachute']['diameter'] = x[0]
+    edl_system['rover']['wheel_assembly']['wheel']['radius'] = x[1]
+    edl_system['rover']['chassis']['mass'] = x[2]
+    edl_system['rover']['wheel_assembly']['speed_reducer']['diam_gear'] = x[3]
+    edl_system['rocket']['initial_fuel_mass'] = x[4]
+    edl_system['rocket']['fuel_mass'] = x[4]
+
+    return edl_system
+
+
+def design_constraints(record, edl_system, problem):
+    """
+    Constraint vector (feasible when every entry is <= 0), in the order of
+    constraints_edl_system: [distance, strength, velocity, cost, battery].
+
+    Input:
+    record : dict
+        Simulation results of the design (see simulate_design)
+    edl_system : dict
+        The edl_system of the design
+    problem : dict
+        See define_design_problem
+    """
+
+    end_event = problem["end_event"]
+
+    # should have traversed the whole course
+    c_distance = (end_event['max_distance'] - record['distance_traveled'])/end_event['max_distance']
+
+    # rover chassis strength
+    c_strength = -edl_system['rover']['chassis']['mass']*edl_system['rover']['chassis']['specific_strength'] \
+        + problem['min_strength']
+
+    # touchdown speed
+    c_velocity = -problem['max_rover_velocity'] + abs(record['rover_touchdown_speed'])
+
+    # total cost
+    c_cost = record['cost'] - problem['max_cost']
+
+    # battery energy
+    c_battery = record['energy_per_distance'] - problem['max_batt_energy_per_meter']
+
+    return np.array([c_distance, c_strength, c_velocity, c_cost, c_battery])
+
+
+# Decomposed simulation
+#
+# The EDL simulation only depends on the parachute diameter, the fuel mass
+# and the total rover mass; the rover traverse only depends on the wheel
+# radius, the gear diameter and the chassis mass. simulate_design runs the
+# two parts separately and combines them, and the design cache keeps the
+# parts under these smaller keys, so a design that shares its EDL (or rover)
+# inputs with one seen before only runs the other simulation. A
+# finite-difference step in the wheel radius or gear diameter, for example,
+# skips the EDL simulation.
+
+def design_system(x, problem):
+    """
+    Fresh copy of the baseline edl_system with design x applied.
+    """
+
+    return apply_design(x, copy.deepcopy(problem['edl_system']))
+
+
+def edl_part_key(x, edl_system, digits=12):
+    """
+    Key of the EDL part of design x: (parachute diameter, fuel mass, rover mass).
+    """
+
+    return design_key([x[0], x[4], get_mass_rover(edl_system)], digits)
+
+
+def rover_part_key(x, digits=12):
+    """
+    Key of the rover part of design x: (wheel radius, gear diameter, chassis mass).
+    """
+
+    return design_key([x[1], x[3], x[2]], digits)
+
+
+def simulate_design_edl(x, problem):
+    """
+    EDL part of design x: {'time_edl', 'edl_system'}, where edl_system is
+    the system as simulate_edl returns it.
+    """
+
+    edl_system = design_system(x, problem)
+    time_edl_run, _, edl_system = simulate_edl(edl_system, problem['planet'], problem['mission_events'],
+                                               problem['tmax'], False)
+
+    return {"time_edl": float(time_edl_run[-1]), "edl_system": edl_system}
+
+
+def simulate_design_rover(x, problem):
+    """
+    Rover part of design x: {'telemetry'}, the telemetry of simulate_rover.
+    """
+
+    rover = design_system(x, problem)['rover']
+    rover = simulate_rover(rover, problem['planet'], problem['experiment'], problem['end_event'])
+
+    return {"telemetry": rover['telemetry']}
+
+
+def combine_design(x, problem, edl_part, rover_part):
+    """
+    Builds the record of design x (see simulate_design) from its EDL and
+    rover parts.
+    """
+
+    # the system after EDL, with this design's rover (the cached EDL part may
+    # come from a design with another wheel radius or gear diameter) carrying
+    # the flags the EDL simulation set and this design's rover telemetry
+    edl_system = copy.deepcopy(edl_part['edl_system'])
+    rover = design_system(x, problem)['rover']
+    rover.update({key: value for key, value in edl_system['rover'].items() if not isinstance(value, dict)})
+    rover['telemetry'] = copy.deepcopy(rover_part['telemetry'])
+    edl_system['rover'] = rover
+
+    telemetry = rover['telemetry']
+    time_edl = edl_part['time_edl']
+    time_rover = telemetry['completion_time']
+
+    record = {"x": np.array(x, dtype=float),
+              "time_edl": float(time_edl),
+              "time_rover": float(time_rover),
+              "total_time": float(time_edl + time_rover),
+              "rover_touchdown_speed": float(edl_system['rover_touchdown_speed']),
+              "distance_traveled": float(telemetry['distance_traveled']),
+              "average_velocity": float(telemetry['average_velocity']),
+              "battery_energy": float(telemetry['battery_energy']),
+              "energy_per_distance": float(telemetry['energy_per_distance']),
+              "cost": float(get_cost_edl(edl_system))
+              }
+    record["constraints"] = design_constraints(record, edl_system, problem)
+
+    return record
+
+
+def _part_lookup(parts, key, cache):
+    # LRU lookup in one of the part caches ("edl" or "rover")
+
+    records = cache[parts + "_records"]
+    if key in records:
+        records.move_to_end(key)
+        cache[parts + "_hits"] += 1
+        return records[key]
+
+    return None
+
+
+def _part_insert(parts, key, part, cache):
+
+    records = cache[parts + "_records"]
+    records[key] = part
+    if len(records) > cache["maxsize"]:
+        records.popitem(last=False)
+
+
+def simulate_design(x, problem, cache=None):
+    """
+    Runs the EDL and rover simulations for design x and returns the scalar
+    results. With a design cache (see new_design_cache), a part whose inputs
+    were simulated before is taken from it instead.
+
+    Input:
+    x : numpy.ndarray
+        Design vector
+    problem : dict
+        See define_design_problem
+    cache : dict
+        See new_design_cache (optional)
+
+    Output:
+    record : dict
+        x, time_edl, time_rover, total_time, rover_touchdown_speed,
+        distance_traveled, average_velocity, battery_energy,
+        energy_per_distance, cost, constraints
+    """
+
+    if cache is None:
+        cache = new_design_cache()
+
+    key = edl_part_key(x, design_system(x, problem), cache["digits"])
+    edl_part = _part_lookup("edl", key, cache)
+    if edl_part is None:
+        edl_part = simulate_design_edl(x, problem)
+        _part_insert("edl", key, edl_part, cache)
+
+    key = rover_part_key(x, cache["digits"])
+    rover_part = _part_lookup("rover", key, cache)
+    if rover_part is None:
+        rover_part = simulate_design_rover(x, problem)
+        _part_insert("rover", key, rover_part, cache)
+
+    return combine_design(x, problem, edl_part, rover_part)
+
+
+def new_design_cache(maxsize=256, digits=12):
+    """
+    Creates an empty LRU cache for evaluate_design. Besides whole designs it
+    keeps the EDL and rover parts of their simulations (see simulate_design).
+
+    Input:
+    maxsize : int
+        Maximum number of designs (and of EDL and rover parts) kept; the
+        least recently used is dropped
+    digits : int
+        Significant digits of each design variable used as the cache key.
+        Designs that agree to this many digits share one simulation. Keep it
+        well above the resolution of finite-difference steps (~8 digits).
+    """
+
+    cache = {"records": OrderedDict(),
+             "edl_records": OrderedDict(),
+             "rover_records": OrderedDict(),
+             "maxsize": maxsize,
+             "digits": digits,
+             "hits": 0,
+             "misses": 0,
+             "edl_hits": 0,
+             "rover_hits": 0
+             }
+
+    return cache
+
+
+def design_key(x, digits=12):
+    """
+    Hashable key of design x, rounded to the given significant digits.
+    """
+
+    return tuple(float("{:.{}g}".format(float(xi), digits)) for xi in np.ravel(x))
+
+
+# Persistent design store
+#
+# Results are also kept on disk so that rerunning an optimization (different
+# bounds, starting point or optimizer, same baseline) does not simulate
+# designs it has already seen. The store is one append-only file of
+# fixed-size binary records:
+#
+#   key    : 32 bytes, sha256 of (problem digest, rounded design vector)
+#   values : STORE_FIELDS followed by the constraint vector, float64
+#
+# The problem digest hashes everything a result depends on besides x (the
+# baseline edl_system, planet, mission_events, tmax, experiment, end_event and
+# the constraint limits), so stores never serve results of a different
+# baseline and several baselines can share one file. The index (key -> row)
+# is rebuilt from the file when the store is opened.
+
+STORE_FIELDS = ("time_edl", "time_rover", "total_time", "rover_touchdown_speed",
+                "distance_traveled", "average_velocity", "battery_energy",
+                "energy_per_distance", "cost")
+
+NUM_CONSTRAINTS = 5
+
+STORE_DTYPE = np.dtype([("key", "S32"), ("values", "<f8", (len(STORE_FIELDS) + NUM_CONSTRAINTS,))])
+
+
+def _update_digest(h, obj):
+    # feeds a canonical description of obj into the hash h
+
+    if isinstance(obj, dict):
+        h.update(b"dict")
+        for key in sorted(obj, key=repr):
+            _update_digest(h, key)
+            _update_digest(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(type(obj).__name__.encode())
+        for item in obj:
+            _update_digest(h, item)
+    elif isinstance(obj, np.ndarray):
+        h.update(b"ndarray" + str(obj.dtype).encode() + repr(obj.shape).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, types.FunctionType):
+        # planet functions are lambdas; hash what they compute, not their id
+        _update_digest(h, obj.__code__)
+        _update_digest(h, obj.__defaults__)
+        _update_digest(h, [cell.cell_contents for cell in (obj.__closure__ or ())])
+    elif isinstance(obj, types.CodeType):
+        h.update(obj.co_code)
+        _update_digest(h, obj.co_consts)
+        _update_digest(h, obj.co_names)
+    else:
+        h.update(type(obj).__name__.encode() + repr(obj).encode())
+
+
+def problem_digest(problem):
+    """
+    Hex sha256 digest of a design problem (see define_design_problem).
+    """
+
+    h = hashlib.sha256()
+    _update_digest(h, problem)
+
+    return h.hexdigest()
+
+
+def open_design_store(path, problem, digits=12):
+    """
+    Opens (or creates) the on-disk design store at path for problem.
+
+    Input:
+    path : str
+        Store file
+    problem : dict
+        See define_design_problem
+    digits : int
+        Significant digits of the design variables in the key (see
+        new_design_cache)
+
+    Output:
+    store : dict
+        Pass to evaluate_design; close with close_design_store
+    """
+
+    index = {}
+    if os.path.exists(path):
+        raw = np.fromfile(path, dtype=np.uint8)
+        # a record cut short by a crash is ignored (and overwritten below)
+        num_records = raw.size // STORE_DTYPE.itemsize
+        data = raw[:num_records*STORE_DTYPE.itemsize].view(STORE_DTYPE)
+        for row in data:
+            index[row["key"]] = row["values"].copy()
+        if raw.size != num_records*STORE_DTYPE.itemsize:
+            with open(path, "r+b") as handle:
+                handle.truncate(num_records*STORE_DTYPE.itemsize)
+
+    store = {"path": path,
+             "digest": problem_digest(problem),
+             "digits": digits,
+             "index": index,
+             "file": open(path, "ab"),
+             "hits": 0
+             }
+
+    return store
+
+
+def close_design_store(store):
+    """
+    Closes the store file.
+    """
+
+    store["file"].close()
+
+
+def _store_key(store, x):
+
+    key = design_key(x, store["digits"])
+    text = store["digest"] + repr(key)
+
+    return hashlib.sha256(text.encode()).digest()
+
+
+def _store_lookup(store, x):
+
+    values = store["index"].get(_store_key(store, x))
+    if values is None:
+        return None
+
+    store["hits"] += 1
+    record = {field: float(value) for field, value in zip(STORE_FIELDS, values)}
+    record["x"] = np.array(x, dtype=float)
+    record["constraints"] = values[len(STORE_FIELDS):].copy()
+
+    return record
+
+
+def _store_append(store, x, record):
+
+    row = np.zeros(1, dtype=STORE_DTYPE)
+    row["key"] = _store_key(store, x)
+    row["values"] = [record[field] for field in STORE_FIELDS] + list(record["constraints"])
+
+    store["file"].write(row.tobytes())
+    store["file"].flush()
+    store["index"][row["key"][0]] = row["values"][0].copy()
+
+
+def _lookup_design(x, cache, store):
+    # record of x from cache or store, None if neither has it
+
+    if cache is not None:
+        key = design_key(x, cache["digits"])
+        records = cache["records"]
+        if key in records:
+            records.move_to_end(key)
+            cache["hits"] += 1
+            return records[key]
+        cache["misses"] += 1
+
+    record = None if store is None else _store_lookup(store, x)
+    if record is not None and cache is not None:
+        _cache_insert(cache, x, record)
+
+    return record
+
+
+def _cache_insert(cache, x, record):
+
+    records = cache["records"]
+    records[design_key(x, cache["digits"])] = record
+    if len(records) > cache["maxsize"]:
+        records.popitem(last=False)
+
+
+def _remember_design(x, record, cache, store):
+    # adds a freshly simulated record to cache and store
+
+    if store is not None:
+        _store_append(store, x, record)
+    if cache is not None:
+        _cache_insert(cache, x, record)
+
+
+def evaluate_design(x, problem, cache=None, store=None):
+    """
+    Returns the simulation results of design x (see simulate_design),
+    simulating it only if it is not in cache or store already.
+
+    Input:
+    x : numpy.ndarray
+        Design vector
+    problem : dict
+        See define_design_problem
+    cache : dict
+        In-memory LRU cache, see new_design_cache (optional)
+    store : dict
+        On-disk design store, see open_design_store (optional). Must have
+        been opened for the same problem.
+
+    Output:
+    record : dict
+        Treat as read-only; it is shared by every caller asking for x.
+    """
+
+    record = _lookup_design(x, cache, store)
+
+    if record is None:
+        record = simulate_design(x, problem, cache)
+        _remember_design(x, record, cache, store)
+
+    return record
+
+
+
+# Parallel evaluation
+#
+# A pool of worker processes receives the problem once, through the pool
+# initializer, and afterwards only design vectors and simulation parts travel
+# between processes. Pools use the "fork" start method where it exists, so the planet
+# (whose atmosphere model is a dict of lambdas) is inherited rather than
+# pickled. Elsewhere the workers get picklable_problem(problem), whose
+# atmosphere is tabulated. The cache and store are only touched by the
+# calling process.
+
+_WORKER_PROBLEM = None
+
+
+def _init_design_worker(problem):
+
+    global _WORKER_PROBLEM
+    _WORKER_PROBLEM = problem
+
+
+def _simulate_part(task, problem):
+
+    parts, x = task
+    if parts == "edl":
+        return simulate_design_edl(x, problem)
+
+    return simulate_design_rover(x, problem)
+
+
+def _simulate_part_in_worker(task):
+
+    return _simulate_part(task, _WORKER_PROBLEM)
+
+
+def picklable_problem(problem):
+    """
+    Copy of problem that can be pickled: the planet's atmosphere functions
+    are replaced by a table (see tabulated_planet), which agrees with them
+    to about 1e-7 relative.
+    """
+
+    planet = problem["planet"]
+    if "atmosphere_table" in planet:
+        return problem
+
+    new_problem = dict(problem)
+    new_problem["planet"] = tabulated_planet(planet)
+
+    return new_problem
+
+
+def new_design_pool(problem, processes=None):
+    """
+    Starts a pool of worker processes for evaluate_designs.
+
+    Input:
+    problem : dict
+        See define_design_problem
+    processes : int
+        Number of workers (default: number of CPUs)
+
+    Output:
+    pool : multiprocessing.pool.Pool
+        Close with close_design_pool
+    """
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+        problem = picklable_problem(problem)
+
+    return context.Pool(processes, initializer=_init_design_worker, initargs=(problem,))
+
+
+def close_design_pool(pool):
+    """
+    Stops the worker processes of a pool from new_design_pool.
+    """
+
+    pool.close()
+    pool.join()
+
+
+def evaluate_designs(X, problem, cache=None, store=None, pool=None):
+    """
+    evaluate_design for several designs at once. For the designs that are
+    not in cache or store, the EDL and rover parts that are not in cache
+    either are simulated concurrently on pool (serially if pool is None),
+    each distinct part once.
+
+    Input:
+    X : numpy.ndarray
+        Design vectors, one per row
+    problem : dict
+        See define_design_problem
+    cache, store : dict
+        See evaluate_design (optional)
+    pool : multiprocessing.pool.Pool
+        See new_design_pool (optional)
+
+    Output:
+    records : list
+        One record per row of X, in order
+    """
+
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    records = [_lookup_design(x, cache, store) for x in X]
+
+    if cache is None:
+        cache = new_design_cache()
+    digits = cache["digits"]
+
+    # unique designs still missing, grouped as the cache groups them
+    missing = OrderedDict()
+    for k, x in enumerate(X):
+        if records[k] is None:
+            missing.setdefault(design_key(x, digits), []).append(k)
+
+    if not missing:
+        return records
+
+    X_missing = [X[rows[0]] for rows in missing.values()]
+
+    # distinct EDL and rover parts still to simulate
+    keys = []
+    tasks = OrderedDict()
+    for x in X_missing:
+        edl_key = edl_part_key(x, design_system(x, problem), digits)
+        rover_key = rover_part_key(x, digits)
+        keys.append((edl_key, rover_key))
+        if _part_lookup("edl", edl_key, cache) is None:
+            tasks.setdefault(("edl", edl_key), ("edl", x))
+        if _part_lookup("rover", rover_key, cache) is None:
+            tasks.setdefault(("rover", rover_key), ("rover", x))
+
+    if pool is None:
+        new_parts = [_simulate_part(task, problem) for task in tasks.values()]
+    else:
+        new_parts = pool.map(_simulate_part_in_worker, list(tasks.values()), chunksize=1)
+    for (parts, key), part in zip(tasks, new_parts):
+        _part_insert(parts, key, part, cache)
+
+    for x, (edl_key, rover_key), rows in zip(X_missing, keys, missing.values()):
+        record = combine_design(x, problem, cache["edl_records"][edl_key], cache["rover_records"][rover_key])
+        _remember_design(x, record, cache, store)
+        for k in rows:
+            records[k] = record
+
+    return records
+
+
+def vectorized_objective(X, problem, cache=None, store=None, pool=None):
+    """
+    Total time of the designs in the columns of X, in the layout of
+    differential_evolution(..., vectorized=True): X has shape (n, S) and the
+    result shape (S,). A single design of shape (n,) gives a float.
+    """
+
+    X = np.asarray(X, dtype=float)
+    records = evaluate_designs(X.T, problem, cache, store, pool)
+    f = np.array([record["total_time"] for record in records])
+
+    return f if X.ndim > 1 else f[0]
+
+
+def vectorized_constraints(X, problem, cache=None, store=None, pool=None):
+    """
+    Constraint vectors of the designs in the columns of X, shape (5, S), for
+    a NonlinearConstraint of differential_evolution(..., vectorized=True).
+    A single design of shape (n,) gives shape (5,).
+    """
+
+    X = np.asarray(X, dtype=float)
+    records = evaluate_designs(X.T, problem, cache, store, pool)
+    c = np.array([record["constraints"] for record in records]).T
+
+    return c if X.ndim > 1 else c[:, 0]
+
+
+def fd_derivatives(x, problem, cache=None, store=None, pool=None, upper=None):
+    """
+    Forward-difference gradient of the total time and Jacobian of the
+    constraint vector at design x. The n+1 designs involved are evaluated
+    together (see evaluate_designs), so with a pool and a cache one call
+    costs about one simulation, and asking for the objective gradient and
+    the constraint Jacobian at the same x simulates them only once.
+
+    Steps are h_i = sqrt(eps)*max(|x_i|, 1), like scipy's default, taken
+    backward where x_i + h_i would exceed upper[i].
+
+    Input:
+    x : numpy.ndarray
+        Design vector
+    problem : dict
+        See define_design_problem
+    cache, store, pool :
+        See evaluate_designs (optional)
+    upper : numpy.ndarray
+        Upper bounds of the design variables (optional)
+
+    Output:
+    grad : numpy.ndarray
+        d(total_time)/dx, shape (n,)
+    jac : numpy.ndarray
+        d(constraints)/dx, shape (5, n)
+    """
+
+    x = np.asarray(x, dtype=float)
+    h = np.sqrt(np.finfo(float).eps)*np.maximum(np.abs(x), 1.0)
+    if upper is not None:
+        h = np.where(x + h > np.asarray(upper, dtype=float), -h, h)
+
+    X = np.tile(x, (x.size + 1, 1))
+    X[1:] += np.diag(h)
+    # exact steps that were taken after rounding x + h
+    dx = np.diag(X[1:]) - x
+
+    records = evaluate_designs(X, problem, cache, store, pool)
+
+    f = np.array([record["total_time"] for record in records])
+    c = np.array([record["constraints"] for record in records])
+
+    grad = (f[1:] - f[0])/dx
+    jac = ((c[1:] - c[0])/dx[:, None]).T
+
+    return grad, jac
@@ -0,0 +1,371 @@
+import time
+import numpy as np
+from bisect import bisect_right
+from scipy.interpolate import CubicSpline, PchipInterpolator
+from scipy.integrate import solve_ivp, RK23, RK45, DOP853, Radau, BDF, LSODA
+from scipy.optimize import brentq
+
+
+
+# Piecewise cubic polynomials
+#
+# A "pp" is a plain dictionary holding the breakpoints and the cubic
+# coefficients of an interpolant that was fitted once. Evaluating it does not
+# need scipy, so it is cheap enough to call inside an ODE right hand side, and
+# (unlike a dict of lambdas) it can be pickled and sent to worker processes.
+#
+#   pp["breaks"] : numpy.ndarray, shape (n,)       breakpoints x_0 < ... < x_n-1
+#   pp["coefs"]  : numpy.ndarray, shape (4, n-1)   coefficients, highest power first
+#   pp["rows"]   : list of 4-tuples                same coefficients, per interval,
+#                                                  as python floats for scalar calls
+#
+# Outside the breakpoints the end polynomials are extrapolated, which is what
+# interp1d(..., fill_value="extrapolate") and PchipInterpolator do.
+
+def pp_from_ppoly(ppoly):
+    """
+    Converts a fitted scipy PPoly-like interpolant (CubicSpline, PchipInterpolator)
+    into a pp dictionary.
+    """
+
+    breaks = np.asarray(ppoly.x, dtype=float)
+    coefs = np.asarray(ppoly.c, dtype=float)
+
+    if coefs.shape[0] != 4:
+        raise Exception("only piecewise cubic interpolants are supported")
+
+    pp = {"breaks": breaks,
+          "coefs": coefs,
+          "breaks_list": breaks.tolist(),
+          "rows": [tuple(row) for row in coefs.T.tolist()]
+          }
+
+    return pp
+
+
+def cubic_spline_pp(x, y):
+    """
+    Not-a-knot cubic spline through (x, y). This is the same curve as
+    interp1d(x, y, kind='cubic').
+    """
+
+    return pp_from_ppoly(CubicSpline(np.asarray(x, dtype=float), np.asarray(y, dtype=float),
+                                     bc_type="not-a-knot"))
+
+
+def pchip_pp(x, y):
+    """
+    Shape-preserving piecewise cubic Hermite interpolant through (x, y).
+    This is the same curve as scipy's PchipInterpolator(x, y).
+    """
+
+    return pp_from_ppoly(PchipInterpolator(np.asarray(x, dtype=float), np.asarray(y, dtype=float)))
+
+
+def ppval(pp, x, nu=0):
+    """
+    Evaluates a pp dictionary (nu=0) or its first derivative (nu=1).
+
+    Input:
+    pp : dict
+        Piecewise cubic built by cubic_spline_pp, pchip_pp or pp_from_ppoly
+    x : float or numpy.ndarray
+        Evaluation point(s)
+    nu : int
+        Order of derivative (0 or 1)
+
+    Output:
+    y : float or numpy.ndarray
+        Value(s) of the interpolant, same shape as x
+    """
+
+    if np.ndim(x) == 0:
+        # scalar path: plain python arithmetic, no temporaries
+        x = float(x)
+        breaks = pp["breaks_list"]
+        i = bisect_right(breaks, x) - 1
+        if i < 0:
+            i = 0
+        elif i > len(breaks) - 2:
+            i = len(breaks) - 2
+        c0, c1, c2, c3 = pp["rows"][i]
+        dx = x - breaks[i]
+        if nu == 0:
+            return ((c0*dx + c1)*dx + c2)*dx + c3
+        if nu == 1:
+            return (3*c0*dx + 2*c1)*dx + c2
+        raise Exception("nu must be 0 or 1")
+
+    x = np.asarray(x, dtype=float)
+    breaks = pp["breaks"]
+    coefs = pp["coefs"]
+
+    # interval of each point; points outside the breaks use the end pieces
+    i = np.searchsorted(breaks[1:-1], x, side="right")
+    dx = x - breaks[i]
+    c = coefs[:, i]
+
+    if nu == 0:
+        return ((c[0]*dx + c[1])*dx + c[2])*dx + c[3]
+    if nu == 1:
+        return (3*c[0]*dx + 2*c[1])*dx + c[2]
+    raise Exception("nu must be 0 or 1")
+
+
+
+# Lockstep integration of many copies of one ODE system
+#
+# solve_ivp stops the whole integration at the first terminal event, so it
+# cannot integrate an ensemble whose members finish (or change stage) at
+# different times. integrate_lockstep drives one of scipy's OdeSolver classes
+# over the stacked (N, n) state and locates the events of every member
+# itself. Members that are done get a zero derivative, so they are frozen at
+# their final state. An event that changes a member's state or stage restarts
+# the solver at the event time. One that only finishes members does not need
+# to with the explicit Runge-Kutta methods: their rows are reset to the final
+# state and their derivative to zero, and the step goes on.
+
+ODE_METHODS = {"RK23": RK23,
+               "RK45": RK45,
+               "DOP853": DOP853,
+               "Radau": Radau,
+               "BDF": BDF,
+               "LSODA": LSODA
+               }
+
+EPS = np.finfo(float).eps
+
+
+def integrate_lockstep(fun, t_span, y0, events, directions, handle_events,
+                       method="RK45", max_step=np.inf, rtol=1e-3, atol=1e-6):
+    """
+    Integrates N members of an ODE system together as one (N, n) state.
+
+    Input:
+    fun : callable
+        fun(t, Y) returns dY/dt, both of shape (N, n)
+    t_span : 2-tuple
+        (t0, tf)
+    y0 : numpy.ndarray
+        Initial state, shape (N, n)
+    events : callable
+        events(t, Y) returns the event function values, shape (N, E)
+    directions : sequence
+        Crossing direction of each of the E events (-1, 0 or +1, same
+        meaning as solve_ivp)
+    handle_events : callable
+        handle_events(t, Y, hit) is called at every event time with hit, a
+        boolean (N, E) array of the events that fired. It returns (Y, done):
+        the state to restart from and a boolean (N,) array of the members
+        that are finished.
+    method : str
+        One of ODE_METHODS
+
+    Output:
+    T : numpy.ndarray
+        Times (M,). Event times appear twice when handle_events changes the
+        state (before and after the change), like stage boundaries in
+        simulate_edl.
+    Y : numpy.ndarray
+        States (M, N, n)
+    t_end : numpy.ndarray
+        Time at which each member finished (N,)
+    """
+
+    if method not in ODE_METHODS:
+        raise Exception("method must be one of " + ", ".join(ODE_METHODS))
+
+    t0, tf = float(t_span[0]), float(t_span[1])
+    Y = np.array(y0, dtype=float)
+    N, n = Y.shape
+    directions = np.asarray(directions)
+
+    done = np.zeros(N, dtype=bool)
+    t_end = np.full(N, np.nan)
+    Y_final = np.zeros((N, n))
+
+    def flat_fun(t, y):
+        dY = fun(t, y.reshape(N, n))
+        dY[done] = 0.0
+        return dY.ravel()
+
+    T_chunks = [t0]
+    Y_chunks = [Y.copy()]
+
+    # events that fired at the restart time are zero there; they are not
+    # looked for again in the first step, or they would fire over and over
+    last_hit = None
+
+    finished = False
+    while not finished:
+
+        solver = ODE_METHODS[method](flat_fun, t0, Y.ravel(), tf, max_step=max_step,
+                                     rtol=rtol, atol=atol)
+        # explicit Runge-Kutta steps only carry y and f = fun(t, y) over
+        freeze = isinstance(solver, (RK23, RK45, DOP853))
+        g_old = events(t0, Y)
+        finished = True
+
+        while solver.status == "running":
+
+            solver.step()
+            if solver.status == "failed":
+                raise Exception("integration failed at t = {:.6f}".format(solver.t))
+
+            t_new = solver.t
+            Y_new = solver.y.reshape(N, n)
+            g_new = events(t_new, Y_new)
+
+            # same crossing test as solve_ivp
+            up = (g_old <= 0) & (g_new >= 0)
+            down = (g_old >= 0) & (g_new <= 0)
+            hit = (up & (directions > 0)) | (down & (directions < 0)) | ((up | down) & (directions == 0))
+            hit &= ~done[:, None]
+            if last_hit is not None:
+                hit &= ~last_hit
+                last_hit = None
+
+            if not hit.any():
+                T_chunks.append(t_new)
+                Y_chunks.append(Y_new.copy())
+                g_old = g_new
+                continue
+
+            # locate every crossing in this step and handle them in time
+            # order, until one needs a restart
+            sol = solver.dense_output()
+            t_old = solver.t_old
+            roots = np.full(hit.shape, np.inf)
+            for k, e in zip(*np.nonzero(hit)):
+                g = lambda t: events(t, sol(t).reshape(N, n))[k, e]
+                roots[k, e] = brentq(g, t_old, t_new, xtol=4*EPS, rtol=4*EPS)
+
+            restart = False
+            while np.isfinite(roots).any():
+
+                t_hit = roots.min()
+                hit = roots <= t_hit + 4*EPS*max(1.0, abs(t_hit))
+                Y_hit = sol(t_hit).reshape(N, n)
+                Y_hit[done] = Y_final[done]
+                T_chunks.append(t_hit)
+                Y_chunks.append(Y_hit.copy())
+
+                Y_next, member_done = handle_events(t_hit, Y_hit.copy(), hit)
+                Y_next = np.array(Y_next, dtype=float)
+                new_done = member_done & ~done
+                t_end[new_done] = t_hit
+                Y_final[new_done] = Y_next[new_done]
+                done |= member_done
+                if not np.array_equal(Y_next, Y_hit):
+                    T_chunks.append(t_hit)
+                    Y_chunks.append(Y_next.copy())
+
+                # the step can go on if the events only finished members
+                if not (freeze and done[hit.any(axis=1)].all()
+                        and np.array_equal(Y_next[~done], Y_hit[~done])):
+                    restart = True
+                    break
+                roots[done] = np.inf
+
+            if restart:
+                t0, Y = t_hit, Y_next
+                last_hit = hit
+                finished = done.all() or t0 >= tf
+                break
+
+            Y_new[done] = Y_final[done]
+            solver.f.reshape(N, n)[done] = 0.0
+            T_chunks.append(t_new)
+            Y_chunks.append(Y_new.copy())
+            g_old = g_new
+            if done.all():
+                break
+
+    T = np.array(T_chunks)
+    Y = np.stack(Y_chunks)
+    t_end[~done] = T[-1]
+
+    return T, Y, t_end
+
+
+
+# Solver statistics
+#
+# solve_ivp reports the number of right hand side, Jacobian and LU
+# evaluations, but not how many steps were accepted or rejected, how often
+# the event functions were called or how long it took. solve_ivp_stats runs
+# solve_ivp with the method subclassed and the event functions wrapped to
+# count those as well. The wrappers are only put in place when statistics are
+# asked for, so plain solve_ivp calls pay nothing for them.
+
+def solve_ivp_stats(fun, t_span, y0, method="RK45", events=None, **options):
+    """
+    solve_ivp with solver statistics.
+
+    Input:
+    fun, t_span, y0, method, events, options :
+        Same as for solve_ivp (method is the name of one of ODE_METHODS or
+        an OdeSolver subclass)
+
+    Output:
+    sol : OdeResult
+        Result of solve_ivp
+    stats : dict
+        method (name), wall_time [s], nfev, njev, nlu (as in sol), steps
+        (accepted steps), rejected_steps (None for the implicit methods,
+        whose step attempts cannot be told apart from their Newton
+        iterations) and event_calls (calls of all event functions together)
+    """
+
+    base = ODE_METHODS[method] if isinstance(method, str) else method
+    explicit = issubclass(base, (RK23, RK45, DOP853))
+
+    stats = {"method": base.__name__,
+             "wall_time": 0.0,
+             "nfev": 0,
+             "njev": 0,
+             "nlu": 0,
+             "steps": 0,
+             "rejected_steps": 0 if explicit else None,
+             "event_calls": 0
+             }
+
+    class CountedSolver(base):
+        # every attempt of an explicit Runge-Kutta step costs n_stages right
+        # hand side calls; the rejected ones are retried within _step_impl
+
+        def _step_impl(self):
+            nfev = self.nfev
+            success, message = super()._step_impl()
+            stats["steps"] += success
+            if explicit:
+                stats["rejected_steps"] += (self.nfev - nfev)//self.n_stages - success
+            return success, message
+
+    if callable(events):
+        events = [events]
+    if events is not None:
+        events = [_counted_event(event, stats) for event in events]
+
+    start = time.perf_counter()
+    sol = solve_ivp(fun, t_span, y0, method=CountedSolver, events=events, **options)
+    stats["wall_time"] = time.perf_counter() - start
+
+    stats["nfev"] = sol.nfev
+    stats["njev"] = sol.njev
+    stats["nlu"] = sol.nlu
+
+    return sol, stats
+
+
+def _counted_event(event, stats):
+    # event function that counts its calls in stats["event_calls"]
+
+    def counted(t, y):
+        stats["event_calls"] += 1
+        return event(t, y)
+
+    counted.terminal = getattr(event, "terminal", False)
+    counted.direction = getattr(event, "direction", 0)
+
+    return counted
@@ -0,0 +1,147 @@
+import multiprocessing
+import numpy as np
+from define_edl_system import define_edl_system_1
+from define_planet import define_planet
+from define_mission_events import define_mission_events
+from subfunctions_EDL import simulate_edl
+from redefine_edl_system import redefine_edl_system
+
+
+
+# Parachute size sweeps
+#
+# Each (drag model, diameter) case is an independent EDL simulation, so the
+# cases are spread over a pool of worker processes. Workers build their own
+# planet, mission events and baseline edl_system in the pool initializer
+# (the planet's atmosphere lambdas never have to be pickled). simulate_edl
+# does not modify the edl_system it is given, so every case only replaces
+# the parachute diameter and drag model of the baseline. Only the diameter
+# and drag model go to a worker and only a few floats come back.
+
+_WORKER_SETUP = None
+
+
+def _init_sweep_worker(setup):
+
+    global _WORKER_SETUP
+    _WORKER_SETUP = dict(setup,
+                         planet=define_planet(),
+                         mission_events=define_mission_events(),
+                         edl_system=_define_sweep_baseline(setup))
+
+
+def _define_sweep_baseline(setup):
+    # edl_system shared by all cases: parachute open, rest of the sequence
+    # pending
+
+    edl_system = define_edl_system_1()
+    edl_system = redefine_edl_system(edl_system)
+
+    edl_system['altitude'] = setup['altitude']
+    edl_system['velocity'] = setup['velocity']
+
+    edl_system['rocket']['on'] = False
+    edl_system['parachute']['deployed'] = True
+    edl_system['parachute']['ejected'] = False
+    edl_system['heat_shield']['ejected'] = False
+    edl_system['sky_crane']['on'] = False
+    edl_system['speed_control']['on'] = False
+    edl_system['position_control']['on'] = False
+
+    return edl_system
+
+
+def _define_sweep_case(diameter, drag_model, setup):
+    # edl_system of one case: the baseline with its own parachute (the
+    # baseline itself is left as it is)
+
+    edl_system = dict(setup['edl_system'])
+    edl_system['parachute'] = dict(edl_system['parachute'], diameter=diameter)
+    if drag_model is not None:
+        edl_system['drag_model'] = drag_model
+
+    return edl_system
+
+
+def _run_sweep_case(case):
+
+    diameter, drag_model = case
+    setup = _WORKER_SETUP
+
+    edl_system = _define_sweep_case(diameter, drag_model, setup)
+    t, Y, edl_system = simulate_edl(edl_system, setup['planet'], setup['mission_events'],
+                                    setup['tmax'], False)
+
+    return (t[-1], Y[0, -1], Y[0, -1] + Y[5, -1], Y[1, -1],
+            float(edl_system['rover']['on_ground']))
+
+
+def sweep_parachute(diameters, drag_models=(None,), tmax=2000, altitude=11000, velocity=-590,
+                    processes=None):
+    """
+    Simulates the EDL sequence from parachute descent for every combination
+    of parachute diameter and drag model.
+
+    Input:
+    diameters : numpy.ndarray
+        Parachute diameters [m]
+    drag_models : sequence
+        Values of edl_system['drag_model'] ('original', 'mach_corrected');
+        None keeps the default of redefine_edl_system
+    tmax : float
+        Simulation time limit [s]
+    altitude, velocity : float
+        Initial altitude [m] and velocity [m/s]
+    processes : int
+        Number of worker processes (default: number of CPUs); 1 runs the
+        cases in this process
+
+    Output:
+    sweep : dict
+        diameters, drag_models and the following arrays of shape
+        (len(drag_models), len(diameters)), in input order:
+        termination_time [s], edl_velocity (final EDL velocity) [m/s],
+        touchdown_speed (EDL plus rover relative velocity) [m/s],
+        sky_crane_altitude (final altitude) [m], on_ground (bool) and
+        success (on ground, touchdown no faster than the sky crane danger
+        speed and sky crane not below its danger altitude)
+    """
+
+    diameters = np.atleast_1d(np.asarray(diameters, dtype=float))
+    drag_models = list(drag_models)
+
+    if diameters.ndim != 1:
+        raise Exception('diameters must be a scalar or a vector')
+
+    setup = {'tmax': tmax, 'altitude': altitude, 'velocity': velocity}
+    cases = [(float(D), drag_model) for drag_model in drag_models for D in diameters]
+
+    if processes == 1:
+        _init_sweep_worker(setup)
+        results = [_run_sweep_case(case) for case in cases]
+    else:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        with context.Pool(processes, initializer=_init_sweep_worker, initargs=(setup,)) as pool:
+            results = pool.map(_run_sweep_case, cases)
+
+    shape = (len(drag_models), diameters.size)
+    results = np.array(results, dtype=float).reshape(shape + (5,))
+
+    sky_crane = define_edl_system_1()['sky_crane']
+
+    sweep = {'diameters': diameters,
+             'drag_models': drag_models,
+             'termination_time': results[..., 0],
+             'edl_velocity': results[..., 1],
+             'touchdown_speed': results[..., 2],
+             'sky_crane_altitude': results[..., 3],
+             'on_ground': results[..., 4] > 0
+             }
+    sweep['success'] = (sweep['on_ground']
+                        & (np.abs(sweep['touchdown_speed']) <= abs(sky_crane['danger_speed']))
+                        & (sweep['sky_crane_altitude'] >= sky_crane['danger_altitude']))
+
+    return sweep
@@ -9,6 +9,10 @@ modified
 import numpy as np
 from subfunctions_Phase4 import *
 from define_experiment import *
+from design_evaluation import define_design_problem, new_design_cache, evaluate_design
+from design_evaluation import open_design_store, close_design_store
+from design_evaluation import new_design_pool, close_design_pool, fd_derivatives
+from design_evaluation import vectorized_objective, vectorized_constraints
 from scipy.optimize import minimize, differential_evolution
 from scipy.optimize import Bounds
 from scipy.optimize import NonlinearConstraint
@@ -60,23 +64,38 @@ bounds = Bounds([14.8, 0.60, 270, 0.05, 210],
                 [15.2, 0.70, 290, 0.055, 230])
 
 x0 = np.array([14.9, 0.70, 280.0, 0.05, 230.0])
+
+# every design is simulated once; the objective, the constraints and the
+# callback report all read from the same cached evaluation
+problem = define_design_problem(edl_system,planet,mission_events,tmax,experiment,
+                                end_event,min_strength,max_rover_velocity,max_cost,
+                                max_batt_energy_per_meter)
+# (large enough to hold a whole differential evolution generation)
+design_cache = new_design_cache(maxsize=1024)
+
+# designs evaluated in earlier runs of this script (same baseline) are read
+# back from disk instead of being simulated again
+design_store = open_design_store('phase4_design_store.bin', problem)
+
+# the finite-difference gradients evaluate x and its perturbed designs on a
+# pool of worker processes; the objective gradient and the constraint
+# Jacobian at the same x share those simulations through design_cache
+design_pool = new_design_pool(problem)
+
 # lambda for the objective function
-obj_f = lambda x: obj_fun_time(x,edl_system,planet,mission_events,tmax,
-                               experiment,end_event)
+obj_f = lambda x: evaluate_design(x,problem,design_cache,design_store)['total_time']
+obj_jac = lambda x: fd_derivatives(x,problem,design_cache,design_store,design_pool,bounds.ub)[0]
 
 # lambda for the constraint functions
 #   ineq_cons is for SLSQP
 #   nonlinear_constraint is for trust-constr
-cons_f = lambda x: constraints_edl_system(x,edl_system,planet,mission_events,
-                                          tmax,experiment,end_event,min_strength,
-                                          max_rover_velocity,max_cost,max_batt_energy_per_meter)
+cons_f = lambda x: evaluate_design(x,problem,design_cache,design_store)['constraints']
+cons_jac = lambda x: fd_derivatives(x,problem,design_cache,design_store,design_pool,bounds.ub)[1]
 
-nonlinear_constraint = NonlinearConstraint(cons_f, -np.inf, 0)  # for trust-constr
+nonlinear_constraint = NonlinearConstraint(cons_f, -np.inf, 0, jac=cons_jac)  # for trust-constr
 ineq_cons = {'type' : 'ineq',
-             'fun' : lambda x: -1*constraints_edl_system(x,edl_system,planet,
-                                                         mission_events,tmax,experiment,
-                                                         end_event,min_strength,max_rover_velocity,
-                                                         max_cost,max_batt_energy_per_meter)}
+             'fun' : lambda x: -1*cons_f(x),
+             'jac' : lambda x: -1*cons_jac(x)}
 
 Nfeval = 1
 def callbackF(Xi):  # this is for SLSQP reporting during optimization
@@ -104,7 +123,7 @@ def callbackF(Xi):  # this is for SLSQP reporting during optimization
 #             # 'initial_barrier_parameter' : 1.0,
 #             'verbose' : 3,
 #             'disp' : True}
-# res = minimize(obj_f, x0, method='trust-constr', constraints=nonlinear_constraint, 
+# res = minimize(obj_f, x0, method='trust-constr', jac=obj_jac, constraints=nonlinear_constraint, 
 #                 options=options, bounds=bounds)
 # end call to the trust-constr optimizer -------------------------------------#
 ###############################################################################
@@ -113,16 +132,22 @@ def callbackF(Xi):  # this is for SLSQP reporting during optimization
 # call the SLSQP optimizer ---------------------------------------------------#
 options = {'maxiter': 50,
             'disp' : True}
-res = minimize(obj_f, x0, method='SLSQP', constraints=ineq_cons, bounds=bounds, 
+res = minimize(obj_f, x0, method='SLSQP', jac=obj_jac, constraints=ineq_cons, bounds=bounds, 
                 options=options, callback=callbackF)
 # end call to the SLSQP optimizer --------------------------------------------#
 ###############################################################################
 
 ###############################################################################
 # call the differential evolution optimizer ----------------------------------#
-# popsize=2 # define the population size
-# maxiter=1 # define the maximum number of iterations
-# res = differential_evolution(obj_f, bounds=bounds, constraints=nonlinear_constraint, popsize=popsize, maxiter=maxiter, disp=True, polish = False) 
+# each generation is evaluated at once: the constraints of all its members are
+# simulated in parallel on design_pool, and the objective is then read from
+# design_cache
+# popsize=50 # define the population size
+# maxiter=20 # define the maximum number of iterations
+# de_obj = lambda X: vectorized_objective(X,problem,design_cache,design_store,design_pool)
+# de_cons = NonlinearConstraint(lambda X: vectorized_constraints(X,problem,design_cache,design_store,design_pool), -np.inf, 0)
+# res = differential_evolution(de_obj, bounds=bounds, constraints=de_cons, popsize=popsize, maxiter=maxiter, disp=True, polish = False,
+#                              vectorized=True, updating='deferred') 
 # end call the differential evolution optimizer ------------------------------#
 ###############################################################################
 
@@ -148,9 +173,9 @@ res = minimize(obj_f, x0, method='SLSQP', constraints=ineq_cons, bounds=bounds,
 
 
 # check if we have a feasible solution 
-c = constraints_edl_system(res.x,edl_system,planet,mission_events,tmax,experiment,
-                           end_event,min_strength,max_rover_velocity,max_cost,
-                           max_batt_energy_per_meter)
+c = cons_f(res.x)
+close_design_pool(design_pool)
+close_design_store(design_store)
 
 feasible = np.max(c - np.zeros(len(c))) <= 0
 if feasible:
@@ -0,0 +1,214 @@
+"""
+Checks of the numerics module against scipy: ppval against the interpolants
+it is built from, and integrate_lockstep against solve_ivp run on each
+member on its own.
+
+Run with:  python -m pytest -q test_numerics.py
+"""
+
+import numpy as np
+import pytest
+from scipy.integrate import solve_ivp
+from scipy.interpolate import CubicSpline, PchipInterpolator
+
+from numerics import cubic_spline_pp, pchip_pp, ppval, integrate_lockstep
+
+
+RTOL = 1e-9
+ATOL = 1e-12
+
+
+# ppval
+
+X_DATA = np.array([0.0, 10.0, 20.0, 40.0, 75.0, 165.0])
+Y_DATA = np.array([0.0, 0.55, 0.75, 0.71, 0.50, 0.05])
+
+# inside, on the breakpoints, and outside on both sides
+X_EVAL = np.concatenate((np.linspace(-20.0, 200.0, 221), X_DATA))
+
+INTERPOLANTS = [(cubic_spline_pp, lambda x, y: CubicSpline(x, y, bc_type="not-a-knot")),
+                (pchip_pp, PchipInterpolator)]
+
+
+@pytest.mark.parametrize("make_pp, make_scipy", INTERPOLANTS)
+@pytest.mark.parametrize("nu", [0, 1])
+def test_ppval_array(make_pp, make_scipy, nu):
+
+    pp = make_pp(X_DATA, Y_DATA)
+    ref = make_scipy(X_DATA, Y_DATA)
+
+    np.testing.assert_allclose(ppval(pp, X_EVAL, nu), ref(X_EVAL, nu), rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("make_pp, make_scipy", INTERPOLANTS)
+@pytest.mark.parametrize("nu", [0, 1])
+def test_ppval_scalar(make_pp, make_scipy, nu):
+
+    pp = make_pp(X_DATA, Y_DATA)
+    ref = make_scipy(X_DATA, Y_DATA)
+
+    for x in X_EVAL:
+        y = ppval(pp, x, nu)
+        assert isinstance(y, float)
+        assert y == pytest.approx(float(ref(x, nu)), rel=1e-12, abs=1e-12)
+        # the scalar and the array paths give the same value
+        assert y == pytest.approx(float(ppval(pp, np.array([x]), nu)[0]), rel=1e-14, abs=1e-14)
+
+
+def test_ppval_shape():
+
+    pp = cubic_spline_pp(X_DATA, Y_DATA)
+    x = np.linspace(-5.0, 170.0, 12).reshape(3, 4)
+
+    assert ppval(pp, x).shape == (3, 4)
+    np.testing.assert_allclose(ppval(pp, x).ravel(), ppval(pp, x.ravel()), rtol=0, atol=0)
+
+
+def test_ppval_bad_derivative():
+
+    pp = cubic_spline_pp(X_DATA, Y_DATA)
+
+    with pytest.raises(Exception):
+        ppval(pp, 1.0, nu=2)
+    with pytest.raises(Exception):
+        ppval(pp, np.array([1.0]), nu=2)
+
+
+# integrate_lockstep
+
+def lockstep(fun, t_span, y0, events, directions, handle_events):
+
+    return integrate_lockstep(fun, t_span, y0, events, directions, handle_events,
+                              method="RK45", rtol=RTOL, atol=ATOL)
+
+
+def test_members_end_at_different_times():
+    # y' = -k y, each member stops when y falls to 0.1
+
+    k = np.array([0.5, 1.0, 2.0, 4.0])
+    y0 = np.ones((k.size, 1))
+
+    def fun(t, Y):
+        return -k[:, None] * Y
+
+    def events(t, Y):
+        return Y - 0.1
+
+    def handle_events(t, Y, hit):
+        return Y, hit[:, 0]
+
+    T, Y, t_end = lockstep(fun, (0.0, 10.0), y0, events, [-1], handle_events)
+
+    for i in range(k.size):
+        event = lambda t, y: y[0] - 0.1
+        event.terminal = True
+        event.direction = -1
+        sol = solve_ivp(lambda t, y: -k[i] * y, (0.0, 10.0), [1.0], events=event,
+                        rtol=RTOL, atol=ATOL)
+
+        assert t_end[i] == pytest.approx(sol.t_events[0][0], rel=1e-8)
+        assert t_end[i] == pytest.approx(np.log(10.0) / k[i], rel=1e-8)
+
+        # frozen at the final state once finished
+        after = T >= t_end[i]
+        np.testing.assert_allclose(Y[after, i, 0], 0.1, rtol=1e-8)
+
+    # every finish time is sampled; the last step may end after the last one
+    assert np.isin(t_end, T).all()
+    assert T[-1] >= t_end.max()
+    assert np.all(np.diff(T) >= 0)
+
+
+def test_events_in_one_step():
+    # y' = 1, so RK45 takes the largest steps it can; the events at 1.0 and
+    # 1.001 (one member each) and at 2.0 and 2.0005 (both on one member, the
+    # first one not terminal) all fall inside single steps
+
+    stops = np.array([[1.0, np.inf], [1.001, np.inf], [2.0, 2.0005]])
+    log = []
+
+    def fun(t, Y):
+        return np.ones_like(Y)
+
+    def events(t, Y):
+        return Y - stops
+
+    def handle_events(t, Y, hit):
+        for i, e in zip(*np.nonzero(hit)):
+            log.append((t, i, e))
+        done = hit[:, 0].copy()
+        done[2] = hit[2, 1]
+        return Y, done
+
+    T, Y, t_end = integrate_lockstep(fun, (0.0, 5.0), np.zeros((3, 2)), events, [1, 1], handle_events,
+                                     method="RK45", max_step=np.inf, rtol=RTOL, atol=ATOL)
+
+    np.testing.assert_allclose(t_end, [1.0, 1.001, 2.0005], rtol=1e-12)
+    assert [(i, e) for t, i, e in log] == [(0, 0), (1, 0), (2, 0), (2, 1)]
+    np.testing.assert_allclose([t for t, i, e in log], [1.0, 1.001, 2.0, 2.0005], rtol=1e-12)
+
+    # solve_ivp finds the same times for the member with two events
+    first = lambda t, y: y[0] - 2.0
+    second = lambda t, y: y[0] - 2.0005
+    second.terminal = True
+    sol = solve_ivp(lambda t, y: np.ones_like(y), (0.0, 5.0), [0.0], events=[first, second],
+                    rtol=RTOL, atol=ATOL)
+    assert log[2][0] == pytest.approx(sol.t_events[0][0], rel=1e-12)
+    assert log[3][0] == pytest.approx(sol.t_events[1][0], rel=1e-12)
+
+
+def bounce_with_solve_ivp(h0, g, e_rest, bounces):
+    # reference: solve_ivp restarted by hand at every bounce
+
+    ground = lambda t, y: y[0]
+    ground.terminal = True
+    ground.direction = -1
+
+    t0, y = 0.0, [h0, 0.0]
+    times = []
+    for _ in range(bounces):
+        sol = solve_ivp(lambda t, y: [y[1], -g], (t0, t0 + 100.0), y, events=ground,
+                        rtol=RTOL, atol=ATOL)
+        t0 = sol.t_events[0][0]
+        times.append(t0)
+        y = [0.0, -e_rest * sol.y_events[0][0][1]]
+
+    return np.array(times)
+
+
+def test_event_at_restart():
+    # bouncing balls: the ground event changes the state, so the solver
+    # restarts at the bounce with the event function exactly zero. The event
+    # has no direction, so unless it is held off at the restart it would fire
+    # again straight away.
+
+    g, e_rest, bounces = 9.81, 0.8, 4
+    h0 = np.array([1.0, 2.5])
+    times = [[], []]
+
+    def fun(t, Y):
+        return np.column_stack((Y[:, 1], np.full(len(Y), -g), np.zeros(len(Y))))
+
+    def events(t, Y):
+        return Y[:, :1]
+
+    def handle_events(t, Y, hit):
+        for i in np.nonzero(hit[:, 0])[0]:
+            times[i].append(t)
+            Y[i, 0] = 0.0
+            Y[i, 1] = -e_rest * Y[i, 1]
+            Y[i, 2] += 1
+        return Y, Y[:, 2] >= bounces
+
+    y0 = np.column_stack((h0, np.zeros(2), np.zeros(2)))
+    T, Y, t_end = lockstep(fun, (0.0, 100.0), y0, events, [0], handle_events)
+
+    for i in range(2):
+        ref = bounce_with_solve_ivp(h0[i], g, e_rest, bounces)
+        assert len(times[i]) == bounces
+        np.testing.assert_allclose(times[i], ref, rtol=1e-8)
+        # analytic: first fall, then flights of 2 v / g with v shrinking by e_rest
+        v = np.sqrt(2 * g * h0[i])
+        exact = np.sqrt(2 * h0[i] / g) + np.concatenate(([0.0], np.cumsum(2 * v * e_rest ** np.arange(1, bounces) / g)))
+        np.testing.assert_allclose(times[i], exact, rtol=1e-8)
+        assert t_end[i] == pytest.approx(exact[-1], rel=1e-8)